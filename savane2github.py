@@ -33,6 +33,8 @@ The basic procedure is as follows:
   - For each item in the JSON tracker file, a GitHub issue will be created. One or more comments may be created for every issue.
 
 Note: This script assumes that you successfully authenticated yourself as a Savannah member using the --username and --password option.
+The session cookies are cached in the project directory and reused by later runs, as long as the session is still valid.
+Only the list and download steps access the Savane server, the other steps do not log in.
 
 Example:
 ```
@@ -46,6 +48,7 @@ Example:
 
 import argparse
 import calendar
+import concurrent.futures
 import json
 from json import JSONEncoder
 from json import JSONDecoder
@@ -53,11 +56,18 @@ import logging
 import os
 import requests
 import sys
+import textwrap
+import threading
 import time
 import bs4
 from github import Github
 from github import GithubException
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
 class ItemType:
     def __init__(self, path, singular, plural):
         self.path = path
@@ -144,6 +154,62 @@ class IssueDecoder(JSONDecoder):
         for k, v in o.items(): setattr(x, k, v)
         return x
 
+def is_login_page(text):
+    return 'name="form_loginname"' in text or "name='form_loginname'" in text
+
+def is_tracker_page(text):
+    return not is_login_page(text) and ('name="item_form"' in text or "name='item_form'" in text)
+
+def read_page(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+def load_session_cookies(session, instance, project, username):
+    path = f'{project}/session_cookies.json'
+    if os.path.isfile(path):
+        logging.debug(f"Reading '{path}'...")
+        with open(path, 'r', encoding='utf-8') as file:
+            cache = json.load(file)
+        if cache.get('instance') != instance:
+            logging.debug(f"Cached session is for '{cache.get('instance')}', ignoring...")
+            return
+        if username and cache.get('username') != username:
+            logging.debug(f"Cached session is for user '{cache.get('username')}', ignoring...")
+            return
+        for cookie in cache.get('cookies', []):
+            session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'], secure=cookie['secure'], expires=cookie['expires'])
+
+def save_session_cookies(session, instance, project, username):
+    path = f'{project}/session_cookies.json'
+    logging.debug(f"Writing '{path}'...")
+    cookies = [{ 'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'secure': c.secure, 'expires': c.expires } for c in session.cookies]
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as file:
+        os.chmod(path, 0o600)
+        json.dump({ 'instance': instance, 'username': username, 'cookies': cookies }, file, sort_keys=True, indent=4)
+
+def is_session_authenticated(session, instance):
+    response = session.get(f'{instance}/my/')
+    return response.ok and not is_login_page(response.text) and 'account/logout.php' in response.text
+
+def authenticate_session(session, instance, project, username, password):
+    load_session_cookies(session, instance, project, username)
+    if len(session.cookies) > 0:
+        logging.debug(f"Validating cached session at '{instance}'...")
+        if is_session_authenticated(session, instance):
+            logging.info(f"Reusing cached session at '{instance}'...")
+            return
+        session.cookies.clear()
+
+    if username and password:
+        logging.info(f"Authenticating at '{instance}' as '{username}'...")
+        form = { 'login': 'Login', 'uri': f'/projects/{project}/', 'form_loginname': username, 'form_pw': password, 'stay_in_ssl': '1', 'cookie_for_a_year': '1', 'brotherhood': '0' }
+        session.post(f'{instance}/account/login.php', data=form)
+        if not is_session_authenticated(session, instance):
+            raise RuntimeError(f"Authentication at '{instance}' as '{username}' failed")
+        save_session_cookies(session, instance, project, username)
+    else:
+        logging.warning(f"No valid session at '{instance}', continuing unauthenticated...")
+
 def list_tracker(session, instance, project, tracker_type):
     logging.info(f"Browsing {tracker_type.plural} at '{instance}/projects/{project}'...")
     items = {}
@@ -176,24 +242,49 @@ def list_tracker(session, instance, project, tracker_type):
     with open(path, 'w', encoding='utf-8') as file:
         json.dump(items, file, sort_keys=True, indent=4)
 
-def download_tracker(session, instance, project, tracker_type,):
+def download_tracker(session, instance, project, username, password, tracker_type):
     path = f'{project}/list_{tracker_type.plural}.json'
     logging.info(f"Reading '{path}'...")
     with open(path, 'r', encoding='utf-8') as file:
         items = json.load(file)
 
+    download_retries = 3
+    download_retry_delay = 5
+    reauthenticated = False
+
     logging.info(f"Downloading {tracker_type.plural} from '{instance}/projects/{project}'...")
     for id in items:
         path = f'{project}/page_{tracker_type.singular}_{id}.html'
-        if os.path.isfile(path):
+        if os.path.isfile(path) and is_tracker_page(read_page(path)):
             logging.debug(f"Page '{path}' exists, skipping...")
         else:
             url = f'{instance}/{tracker_type.path}/?{id}'
-            logging.info(f"Loading page '{url}'...")
-            page = session.get(url).text
-            logging.debug(f"Writing page '{path}'...")
-            with open(path, 'w', encoding='utf-8') as file:
-                file.write(page)
+            attempt = 0
+            while attempt < download_retries:
+                attempt += 1
+                logging.info(f"Loading page '{url}'...")
+                try:
+                    response = session.get(url)
+                except requests.RequestException as err:
+                    logging.warning(f"Loading page '{url}' failed: {err}")
+                else:
+                    if response.ok and is_tracker_page(response.text):
+                        logging.debug(f"Writing page '{path}'...")
+                        with open(path, 'w', encoding='utf-8') as file:
+                            file.write(response.text)
+                        break
+                    if is_login_page(response.text) and not reauthenticated:
+                        logging.warning(f"Page '{url}' is a login page, session expired?")
+                        authenticate_session(session, instance, project, username, password)
+                        reauthenticated = True
+                        attempt -= 1
+                        continue
+                    logging.warning(f"Page '{url}' is a login or error page")
+                if attempt < download_retries:
+                    logging.info(f"Retrying in {download_retry_delay}s...")
+                    time.sleep(download_retry_delay)
+            else:
+                logging.error(f"Page '{url}' could not be downloaded, skipping...")
 
 def import_tracker(instance, project, tracker_type):
     def parse_tracker(instance, tracker_type, text):
@@ -300,7 +391,8 @@ def import_tracker(instance, project, tracker_type):
                 if tracker_comment:
                     cols = row.find_all('td')
                     comment = TrackerComment()
-                    comment.author = cols[1].a.string
+                    author = cols[1].a.string
+                    comment.author = str(author) if author is not None else None
                     comment.time = str(cols[0].a.contents)[2:].split(',')[0]
                     comment.text = html_to_markup(instance, tracker_comment.contents).strip()
                     tracker.comments.insert(0, comment)
@@ -317,6 +409,7 @@ def import_tracker(instance, project, tracker_type):
                     attachment.url = instance + a.get('href', '#')
                     tracker.attachments.insert(0, attachment)
 
+        soup.decompose()
         return tracker
 
     path = f'{project}/list_{tracker_type.plural}.json'
@@ -324,21 +417,30 @@ def import_tracker(instance, project, tracker_type):
     with open(path, 'r', encoding='utf-8') as file:
         items = json.load(file)
 
-    trackers = []
-
-    for id in items:
-        path = f'{project}/page_{tracker_type.singular}_{id}.html'
-        if not os.path.isfile(path):
-            logging.warning(f"Page '{path}' missing, skipping...")
-        else:
-            logging.info(f"Reading page '{path}'...")
-            with open(path, 'r', encoding='utf-8') as file:
-                trackers.append(parse_tracker(instance, tracker_type, file.read()))
-
     path = f'{project}/trackers_{tracker_type.plural}.json'
     logging.info(f"Writing '{path}'...")
-    with open(path, 'w', encoding='utf-8') as file:
-        json.dump(trackers, file, indent=4, cls=IssueEncoder)
+    try:
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            separator = '[\n'
+            for id in items:
+                page_path = f'{project}/page_{tracker_type.singular}_{id}.html'
+                if not os.path.isfile(page_path):
+                    logging.warning(f"Page '{page_path}' missing, skipping...")
+                else:
+                    logging.info(f"Reading page '{page_path}'...")
+                    page = read_page(page_path)
+                    if not is_tracker_page(page):
+                        logging.warning(f"Page '{page_path}' is a login or error page, skipping...")
+                    else:
+                        tracker = parse_tracker(instance, tracker_type, page)
+                        file.write(separator + textwrap.indent(json.dumps(tracker, indent=4, cls=IssueEncoder), ' ' * 4))
+                        separator = ',\n'
+            file.write('[]' if separator == '[\n' else '\n]')
+        os.replace(path + '.tmp', path)
+    except BaseException:
+        if os.path.isfile(path + '.tmp'):
+            os.remove(path + '.tmp')
+        raise
 
 def dump_tracker(project, tracker_type):
     path = f'{project}/trackers_{tracker_type.plural}.json'
@@ -353,43 +455,134 @@ def dump_tracker(project, tracker_type):
             print('------')
             print(comment)
 
-def export_tracker(project, repo_path, access_token, dry_run, tracker_type):
+class ExportAborted(Exception):
+    pass
+
+class RateBudget:
+    def __init__(self, abort, max_queued_writes):
+        self.abort = abort
+        self.max_queued_writes = max_queued_writes
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.next_write_time = 0
+        self.queued_writes = 0
+        self.pause_until = 0
+        self.admit_turn = 0
+        self.issue_turn = 0
+
+    def sleep(self, seconds):
+        if self.abort.wait(max(seconds, 0)):
+            raise ExportAborted()
+
+    def pause(self, seconds):
+        with self.condition:
+            self.pause_until = max(self.pause_until, time.monotonic() + seconds)
+            self.condition.notify_all()
+
+    def check_rate_limit(self, g, rate_limit_delay):
+        core_rate_limit = g.get_rate_limit().core
+        logging.debug(f'Remaining rate_limit.core: {core_rate_limit.remaining}')
+        if core_rate_limit.remaining < 100:
+            reset_timestamp = calendar.timegm(core_rate_limit.reset.timetuple())
+            sleep_time = reset_timestamp - calendar.timegm(time.gmtime()) + rate_limit_delay
+            logging.warning(f'API rate limit reached, waiting {sleep_time}s ...')
+            self.pause(sleep_time)
+
+    def wait_read(self):
+        while True:
+            with self.lock:
+                start = self.pause_until
+            now = time.monotonic()
+            if start <= now:
+                return
+            self.sleep(start - now)
+
+    def wait_write(self, delay):
+        with self.condition:
+            now = time.monotonic()
+            start = max(now, self.pause_until, self.next_write_time)
+            self.next_write_time = start + delay
+            self.queued_writes += 1
+        try:
+            while True:
+                self.sleep(start - now)
+                with self.lock:
+                    now = time.monotonic()
+                    if self.pause_until <= now:
+                        return
+                    start = max(now, self.pause_until, self.next_write_time)
+                    self.next_write_time = start + delay
+        finally:
+            with self.condition:
+                self.queued_writes -= 1
+                self.condition.notify_all()
+
+    def admit_issue(self, turn):
+        with self.condition:
+            while True:
+                if self.abort.is_set():
+                    raise ExportAborted()
+                now = time.monotonic()
+                if self.admit_turn == turn and self.pause_until <= now and self.queued_writes < self.max_queued_writes:
+                    self.admit_turn += 1
+                    self.condition.notify_all()
+                    return
+                self.condition.wait(1)
+
+    def wait_issue_turn(self, turn):
+        with self.condition:
+            while self.issue_turn != turn:
+                if self.abort.is_set():
+                    raise ExportAborted()
+                self.condition.wait(1)
+
+    def next_issue_turn(self):
+        with self.condition:
+            self.issue_turn += 1
+            self.condition.notify_all()
+
+def export_tracker(project, repo_path, access_token, dry_run, export_jobs, tracker_type):
     path = f'{project}/trackers_{tracker_type.plural}.json'
     logging.info(f"Reading '{path}'...")
     with open(path, 'r', encoding='utf-8') as file:
         trackers = json.load(file, cls=IssueDecoder)
 
-    if not dry_run:
-        logging.info(f"Creating GitHub instance...")
-        g = Github(access_token)
-        repo = g.get_repo(repo_path)
-        labels = ['bug', 'question', 'wontfix', 'invalid', 'duplicate', 'enhancement']
-        repo_labels = dict(zip(labels, map(repo.get_label, labels)))
-
     issue_creation_delay = 60
     comment_creation_delay = 1
     issue_edit_delay = 1
     rate_limit_delay = 5
     secondary_rate_limit_delay = 600
+    max_queued_writes = 2
+
+    abort = threading.Event()
+    budget = RateBudget(abort, max_queued_writes)
+    save_lock = threading.Lock()
+    local = threading.local()
+
+    def get_github():
+        if not hasattr(local, 'repo_labels'):
+            logging.info(f"Creating GitHub instance...")
+            g = Github(access_token)
+            repo = g.get_repo(repo_path)
+            labels = ['bug', 'question', 'wontfix', 'invalid', 'duplicate', 'enhancement']
+            repo_labels = dict(zip(labels, map(repo.get_label, labels)))
+            local.g, local.repo, local.repo_labels = g, repo, repo_labels
+        return local.g, local.repo, local.repo_labels
+
+    def save_trackers():
+        with save_lock:
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(trackers, file, indent=4, cls=IssueEncoder)
 
-    for tracker in trackers:
-        if tracker.migration_status == 'complete':
-            continue
-
+    def export_issue(tracker, issue_turn):
         issue_title = f'[{tracker.type} #{tracker.item_id}] {tracker.summary}'
         logging.info(f"Creating issue '{issue_title}'...")
 
-        while True:
+        while not abort.is_set():
             try:
                 if not dry_run:
-                    core_rate_limit = g.get_rate_limit().core
-                    logging.debug(f'Remaining rate_limit.core: {core_rate_limit.remaining}')
-                    if core_rate_limit.remaining < 100:
-                        reset_timestamp = calendar.timegm(core_rate_limit.reset.timetuple())
-                        sleep_time = reset_timestamp - calendar.timegm(time.gmtime()) + rate_limit_delay
-                        logging.warning(f'API rate limit reached, waiting {sleep_time}s ...')
-                        time.sleep(sleep_time)
-                        continue
+                    g, repo, repo_labels = get_github()
+                    budget.check_rate_limit(g, rate_limit_delay)
 
                 issue_body = ''
                 if tracker.originator_name: issue_body += f'{tracker.originator_name} <{tracker.originator_email}>\n'
@@ -422,26 +615,29 @@ def export_tracker(project, repo_path, access_token, dry_run, tracker_type):
 
                 if not dry_run:
                     if hasattr(tracker, 'migration_id') and tracker.migration_id:
+                        budget.wait_read()
                         issue = repo.get_issue(tracker.migration_id)
                     else:
+                        budget.wait_issue_turn(issue_turn)
+                        budget.wait_write(issue_creation_delay)
                         issue = repo.create_issue(title=issue_title, body=issue_body, labels=[repo_labels[label] for label in issue_labels])
                         tracker.migration_id = issue.number
-                        time.sleep(issue_creation_delay)
+                        budget.next_issue_turn()
 
                 for comment in tracker.comments:
                     logging.debug(f"Creating comment...")
                     if not dry_run:
                         if comment.migration_status == 'pending':
+                            budget.wait_write(comment_creation_delay)
                             issue.create_comment(str(comment))
                             comment.migration_status = 'complete'
-                            time.sleep(comment_creation_delay)
 
                 if tracker.status_id == 'Closed':
                     logging.debug(f"Closing issue...")
                     if not dry_run:
                         if (issue.state == 'open'):
+                            budget.wait_write(issue_edit_delay)
                             issue.edit(state='closed')
-                            time.sleep(issue_edit_delay)
 
                 if not dry_run:
                     tracker.migration_status = 'complete'
@@ -449,14 +645,36 @@ def export_tracker(project, repo_path, access_token, dry_run, tracker_type):
             except GithubException as err:
                 if err.status == 403 and 'secondary rate limit' in err.data['message']:
                     logging.warning(f'secondary rate limit exceeded, waiting {secondary_rate_limit_delay}s...')
-                    time.sleep(secondary_rate_limit_delay)
+                    budget.pause(secondary_rate_limit_delay)
                     continue
                 raise
             finally:
-                with open(path, 'w', encoding='utf-8') as file:
-                    json.dump(trackers, file, indent=4, cls=IssueEncoder)
+                save_trackers()
             break;
 
+    def run_issue(tracker, admit_turn, issue_turn):
+        try:
+            budget.admit_issue(admit_turn)
+            export_issue(tracker, issue_turn)
+        except ExportAborted:
+            pass
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=export_jobs) as executor:
+        futures = []
+        issue_turn = 0
+        for tracker in trackers:
+            if tracker.migration_status == 'complete':
+                continue
+            futures.append(executor.submit(run_issue, tracker, len(futures), issue_turn))
+            if not (hasattr(tracker, 'migration_id') and tracker.migration_id):
+                issue_turn += 1
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+        except BaseException:
+            abort.set()
+            raise
+
 def main():
     def parse_commandline():
         parser = argparse.ArgumentParser()
@@ -483,6 +701,7 @@ def main():
         parser.add_argument('--export-tasks', action='store_true', help='Export tasks to GitHub')
         parser.add_argument('--export-patches', action='store_true', help='Export patches to GitHub')
         parser.add_argument('--export-feature-requests', action='store_true', help='Export feature requests to GitHub')
+        parser.add_argument('--export-jobs', type=int, default=4, help='Maximum number of issues exported to GitHub concurrently, fewer are started while rate limited (default 4)')
         parser.add_argument('--dry-run', action='store_true', help='Do not make actual changes to GitHub')
         parser.add_argument('-v', '--verbose', action='store_const', dest='loglevel', default=logging.INFO, const=logging.DEBUG, help='enable verbose command-line output')
         args = parser.parse_args()
@@ -506,6 +725,8 @@ def main():
         valid |= args.export_patches and args.project != None and (args.dry_run or args.repo_path != None and args.access_token != None)
         valid |= args.export_feature_requests and args.project != None and (args.dry_run or args.repo_path != None and args.access_token != None)
 
+        valid &= args.export_jobs > 0
+
         if not valid:
             parser.print_help()
             exit(2)
@@ -515,12 +736,6 @@ def main():
     def setup_logger(loglevel):
         logging.basicConfig(format='%(levelname)s: %(message)s', level=loglevel)
 
-    def authenticate_session(session, instance, project, username, password):
-        if username and password:
-            logging.info(f"Authenticating at '{instance}' as '{username}'...")
-            form = { 'login': 'Login', 'uri': f'/projects/{project}/', 'form_loginname': username, 'form_pw': password, 'stay_in_ssl': '1', 'cookie_for_a_year': '1', 'brotherhood': '0' }
-            response = session.post(f'{instance}/account/login.php', data=form)
-
     print('Savane to GitHub Migration Tool v1.0', file=sys.stderr)
     print('Copyright (C) 2021 Marius Greuel', file=sys.stderr)
     args = parse_commandline()
@@ -536,7 +751,11 @@ def main():
                 'feature-request': ItemType('feature-request', 'feature-request', 'feature-requests')
             }
 
-            authenticate_session(session, args.instance, args.project, args.username, args.password)
+            needs_session = False
+            needs_session |= args.list_bugs or args.list_tasks or args.list_patches
+            needs_session |= args.download_bugs or args.download_tasks or args.download_patches
+            if needs_session:
+                authenticate_session(session, args.instance, args.project, args.username, args.password)
 
             if args.list_bugs:
                 list_tracker(session, args.instance, args.project, what['bug'])
@@ -545,11 +764,11 @@ def main():
             if args.list_patches:
                 list_tracker(session, args.instance, args.project, what['patch'])
             if args.download_bugs:
-                download_tracker(session, args.instance, args.project, what['bug'])
+                download_tracker(session, args.instance, args.project, args.username, args.password, what['bug'])
             if args.download_tasks:
-                download_tracker(session, args.instance, args.project, what['task'])
+                download_tracker(session, args.instance, args.project, args.username, args.password, what['task'])
             if args.download_patches:
-                download_tracker(session, args.instance, args.project, what['patch'])
+                download_tracker(session, args.instance, args.project, args.username, args.password, what['patch'])
             if args.import_bugs:
                 import_tracker(args.instance, args.project, what['bug'])
             if args.import_tasks:
@@ -565,13 +784,18 @@ def main():
             if args.dump_feature_requests:
                 dump_tracker(args.project, what['feature-request'])
             if args.export_bugs:
-                export_tracker(args.project, args.repo_path, args.access_token, args.dry_run, what['bug'])
+                export_tracker(args.project, args.repo_path, args.access_token, args.dry_run, args.export_jobs, what['bug'])
             if args.export_tasks:
-                export_tracker(args.project, args.repo_path, args.access_token, args.dry_run, what['task'])
+                export_tracker(args.project, args.repo_path, args.access_token, args.dry_run, args.export_jobs, what['task'])
             if args.export_patches:
-                export_tracker(args.project, args.repo_path, args.access_token, args.dry_run, what['patch'])
+                export_tracker(args.project, args.repo_path, args.access_token, args.dry_run, args.export_jobs, what['patch'])
             if args.export_feature_requests:
-                export_tracker(args.project, args.repo_path, args.access_token, args.dry_run, what['feature-request'])
+                export_tracker(args.project, args.repo_path, args.access_token, args.dry_run, args.export_jobs, what['feature-request'])
+
+        if resource:
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if sys.platform != 'darwin': peak_rss *= 1024
+            logging.info(f'Process peak memory usage (all steps of this run): {peak_rss / (1024 * 1024):.1f} MiB')
 
         exit(0)
     except SystemExit: